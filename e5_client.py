@@ -0,0 +1,69 @@
+import json
+import logging
+
+import numpy as np
+
+try:
+    import orjson  # Parses the E5 float arrays several times faster than the stdlib json module
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# --- E5 Inference Service ---
+# Shared by the ingestion (test2.py) and evaluation (evaluate.py) scripts so both request and decode
+# embeddings the same way.
+E5_MODEL_NAME = "intfloat/e5-base-v2"  # Model baked into the inference image (see Dockerfile)
+EMBEDDING_DIMENSION = 768  # Output size of E5_MODEL_NAME; change both together
+# IMPORTANT: Adjust this key based on the actual JSON response from your /vectors endpoint.
+# If `curl -X POST -H "Content-Type: application/json" -d '{"text": "test"}' http://localhost:8081/vectors`
+# returns {"embedding": [0.1, 0.2, ...]}, then set this to 'embedding'.
+# If it returns {"vector": [0.1, 0.2, ...]}, then set this to 'vector'.
+# If it returns [0.1, 0.2, ...], then set this to None (meaning the response body is directly the list).
+E5_VECTOR_KEY_IN_RESPONSE = 'vector'  # <<< YOU MIGHT NEED TO CHANGE THIS BASED ON ACTUAL API RESPONSE
+# Servers able to return the raw vector as packed little-endian float32 bytes should prefer that;
+# others ignore the header and answer with JSON as before.
+E5_ACCEPT_HEADERS = {"Accept": "application/octet-stream, application/json;q=0.9"}
+FLOAT32_SIZE = np.dtype(np.float32).itemsize
+
+
+def decode_embedding_response(response, text: str):
+    """
+    Returns the float32 vector from a successful E5 /vectors response (requests or httpx),
+    or None if the body is malformed or not EMBEDDING_DIMENSION long. Errors are logged.
+    """
+    if response.headers.get("content-type", "").startswith("application/octet-stream"):
+        # Packed float32 bytes map straight onto an ndarray: no parsing, no Python float objects
+        if len(response.content) != EMBEDDING_DIMENSION * FLOAT32_SIZE:
+            logging.error(
+                f"E5 API returned {len(response.content)} bytes for text (first 100 chars): '{text[:100]}...'; expected {EMBEDDING_DIMENSION} float32 values.")
+            return None
+        return np.frombuffer(response.content, dtype="<f4")
+
+    try:
+        json_response = json_loads(response.content)
+    except json.JSONDecodeError:  # orjson.JSONDecodeError is a subclass
+        logging.error(
+            f"E5 inference API returned non-JSON response for text (first 100 chars): '{text[:100]}...'. Response: {response.text}")
+        return None
+
+    if E5_VECTOR_KEY_IN_RESPONSE:
+        vector = json_response.get(E5_VECTOR_KEY_IN_RESPONSE) if isinstance(json_response, dict) else None
+        if vector is None:
+            logging.error(
+                f"E5 API response missing key '{E5_VECTOR_KEY_IN_RESPONSE}' for text (first 100 chars): '{text[:100]}...': {str(json_response)[:200]}")
+            return None
+    else:
+        vector = json_response
+
+    if not isinstance(vector, list):
+        logging.error(
+            f"E5 API response vector is not a list of numbers. Type: {type(vector)}, Value: {str(vector)[:200]}...")
+        return None
+
+    # float32 ndarray matches the on-disk cache format and can be stacked into the query matrix directly
+    vector = np.asarray(vector, dtype=np.float32)
+    if vector.shape != (EMBEDDING_DIMENSION,):
+        logging.error(
+            f"E5 API returned a vector of shape {vector.shape} for text (first 100 chars): '{text[:100]}...'; expected ({EMBEDDING_DIMENSION},).")
+        return None
+    return vector
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+from e5_client import E5_MODEL_NAME, EMBEDDING_DIMENSION, FLOAT32_SIZE
+
+# --- Embedding Cache ---
+# Shared by the ingestion (test2.py) and evaluation (evaluate.py) scripts so both use the same key format
+# and file layout. Vectors are stored as raw float32 files keyed by the SHA-256 of the exact text sent to E5,
+# so re-runs (and repeated texts within a run) skip the HTTP call entirely. Each model/endpoint pair gets its
+# own subdirectory, so switching either one starts a fresh cache instead of serving the old model's vectors.
+EMBEDDING_CACHE_ROOT = os.path.join("cache", "e5")
+
+
+def embedding_cache_dir(endpoint: str) -> str:
+    """Cache directory for vectors produced by E5_MODEL_NAME behind `endpoint`."""
+    namespace = hashlib.sha256(f"{E5_MODEL_NAME}|{endpoint}".encode("utf-8")).hexdigest()[:8]
+    return os.path.join(EMBEDDING_CACHE_ROOT, namespace)
+
+
+def _embedding_cache_path(cache_dir: str, text: str) -> str:
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key[:2], f"{key}.f32")
+
+
+def load_cached_embedding(cache_dir: str, text: str):
+    """
+    Returns the cached vector for `text`, or None on a cache miss.
+    Unreadable files, or files that do not hold exactly EMBEDDING_DIMENSION float32 values,
+    are logged and treated as a miss.
+    """
+    path = _embedding_cache_path(cache_dir, text)
+    try:
+        if not os.path.exists(path):
+            return None
+        size = os.path.getsize(path)
+        if size != EMBEDDING_DIMENSION * FLOAT32_SIZE:
+            logging.warning(f"Ignoring embedding cache file {path}: {size} bytes, expected {EMBEDDING_DIMENSION} float32 values.")
+            return None
+        return np.fromfile(path, dtype=np.float32)
+    except OSError as e:
+        logging.warning(f"Failed to read embedding cache file {path}: {e}")
+        return None
+
+
+def store_cached_embedding(cache_dir: str, text: str, vector):
+    """Writes `vector` to the cache. Failures are logged and otherwise ignored."""
+    path = _embedding_cache_path(cache_dir, text)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        np.asarray(vector, dtype=np.float32).tofile(tmp_path)
+        os.replace(tmp_path, path)  # Atomic, so concurrent readers never see a partial file
+    except OSError as e:
+        logging.warning(f"Failed to write embedding cache file {path}: {e}")
+
+
+def disk_cached(endpoint: str):
+    """Serves a synchronous `func(text)` embedding call to `endpoint` from the on-disk cache, populating it on a miss."""
+    cache_dir = embedding_cache_dir(endpoint)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(text: str):
+            vector = load_cached_embedding(cache_dir, text)
+            if vector is None:
+                vector = func(text)
+                if vector is not None:
+                    store_cached_embedding(cache_dir, text, vector)
+            return vector
+        return wrapper
+    return decorator
+
+
+def async_disk_cached(endpoint: str):
+    """
+    Serves an async `func(http_client, text)` embedding call to `endpoint` from the on-disk cache,
+    populating it on a miss. File I/O runs in a worker thread so it does not block the event loop.
+    """
+    cache_dir = embedding_cache_dir(endpoint)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(http_client, text: str):
+            vector = await asyncio.to_thread(load_cached_embedding, cache_dir, text)
+            if vector is None:
+                vector = await func(http_client, text)
+                if vector is not None:
+                    await asyncio.to_thread(store_cached_embedding, cache_dir, text, vector)
+            return vector
+        return wrapper
+    return decorator
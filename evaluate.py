@@ -1,10 +1,14 @@
 import weaviate
 import os
-from beir.datasets.data_loader import GenericDataLoader
-from beir.retrieval.evaluation import EvaluateRetrieval  # Correct import for BEIR 2.2.0
-from tqdm.autonotebook import tqdm
-import requests
-import json
+from tqdm.asyncio import tqdm_asyncio
+import httpx
+import asyncio
+import csv
+import hashlib
+import numpy as np
+from metrics import fast_evaluate
+from e5_client import E5_ACCEPT_HEADERS, E5_MODEL_NAME, EMBEDDING_DIMENSION, decode_embedding_response, json_loads
+from embedding_cache import async_disk_cached
 import logging  # Import logging module for better error reporting
 
 # --- Configure Logging ---
@@ -18,26 +22,119 @@ WEAVIATE_PORT = 8080
 WEAVIATE_GRPC_PORT = 50051
 COLLECTION_NAME = "document_v4"  # Must match the ingestion script's collection name
 E5_INFERENCE_API_URL_FOR_QUERY = "http://localhost:8081/vectors"  # Endpoint for query embedding
-# IMPORTANT: This must match the key you determined for your E5 API response in the ingestion script.
-# If `curl -X POST -H "Content-Type: application/json" -d '{"text": "test"}' http://localhost:8081/vectors`
-# returns {"embedding": [0.1, 0.2, ...]}, then set this to 'embedding'.
-# If it returns {"vector": [0.1, 0.2, ...]}, then set this to 'vector'.
-# If it returns [0.1, 0.2, ...], then set this to None.
-E5_VECTOR_KEY_IN_RESPONSE = 'vector'  # <<< ENSURE THIS MATCHES YOUR INGESTION SCRIPT'S VALUE
+QUERY_PREFIX = "query: "  # E5 expects queries to be prefixed with "query: "
+MAX_CONCURRENT_REQUESTS = 32  # Connection pool size for the E5 service
+SEARCH_MAX_IN_FLIGHT = 50  # Concurrent near_vector searches
+EMBEDDING_MAX_IN_FLIGHT = 64  # Concurrent single-text embedding requests
+# One .npz per dataset holding the (N, D) float32 matrix of query embeddings, the query ids in row order
+# and a fingerprint of the inputs they were computed from
+QUERY_CACHE_PATH = os.path.join("cache", f"{DATASET_NAME}_queries.npz")
+# Search options shared by every near_vector call, built once instead of per query
+RETURN_PROPS = ["original_doc_id"]  # Crucial for mapping back to qrels
+# near_vector only populates the distance; `score` is reserved for bm25/hybrid searches
+META = weaviate.classes.query.MetadataQuery(distance=True)
+
+
+def get_score(obj):
+    """Ranking score for a near_vector hit: the negated distance, so higher is better (None if missing)."""
+    distance = obj.metadata.distance
+    return None if distance is None else -distance
+
 
 # --- 1. Load the SciFact dataset (for queries and qrels) ---
+# Evaluation never looks at the corpus, so only queries.jsonl and the qrels file are read
+# instead of GenericDataLoader.load(), which would also load the whole corpus into memory.
+def load_queries_and_qrels(data_folder: str, split: str):
+    """
+    Returns (queries, qrels) in GenericDataLoader's format: {query_id: text} restricted to queries
+    with judgements, in qrels order, and {query_id: {doc_id: relevance}}.
+    """
+    qrels = {}
+    with open(os.path.join(data_folder, "qrels", f"{split}.tsv"), newline="") as f:
+        reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+        next(reader)  # Header: query-id, corpus-id, score
+        for query_id, doc_id, score in reader:
+            qrels.setdefault(query_id, {})[doc_id] = int(score)
+
+    query_texts = {}
+    with open(os.path.join(data_folder, "queries.jsonl"), "rb") as f:
+        for line in f:
+            if line.strip():
+                record = json_loads(line)
+                if record["_id"] in qrels:
+                    query_texts[record["_id"]] = record.get("text")
+    return {query_id: query_texts[query_id] for query_id in qrels}, qrels
+
+
 logging.info(f"Loading {DATASET_NAME} dataset for evaluation...")
 try:
-    corpus, queries, qrels = GenericDataLoader(os.path.join(DATA_PATH, DATASET_NAME)).load(split="test")
+    queries, qrels = load_queries_and_qrels(os.path.join(DATA_PATH, DATASET_NAME), split="test")
     logging.info(f"Dataset for evaluation loaded. Number of queries: {len(queries)}")
 except Exception as e:
     logging.critical(f"Failed to load dataset for evaluation: {e}")
     exit(1)
 
 
+def query_cache_fingerprint(query_ids: list[str], query_texts: list[str]) -> str:
+    """
+    Identifies what the query cache was computed from: the E5 endpoint and model plus the ordered,
+    prefixed query texts. Changing any of them invalidates the cache instead of reusing stale vectors.
+    """
+    digest = hashlib.sha256()
+    for part in (E5_INFERENCE_API_URL_FOR_QUERY, E5_MODEL_NAME, *query_ids, *query_texts):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load_query_embeddings(fingerprint: str):
+    """
+    Returns (query_ids, query_matrix) from the per-dataset query cache, or (None, None) if it
+    is missing, was computed from different inputs, or is inconsistent.
+    """
+    if not os.path.exists(QUERY_CACHE_PATH):
+        return None, None
+    try:
+        with np.load(QUERY_CACHE_PATH, allow_pickle=False) as cache:
+            if str(cache["fingerprint"]) != fingerprint:
+                logging.info(f"Query embedding cache {QUERY_CACHE_PATH} is stale; re-embedding queries.")
+                return None, None
+            query_ids = cache["query_ids"].tolist()
+            query_matrix = cache["query_matrix"]
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Failed to read query embedding cache {QUERY_CACHE_PATH}: {e}")
+        return None, None
+    if query_matrix.shape != (len(query_ids), EMBEDDING_DIMENSION):
+        logging.warning(
+            f"Query embedding cache {QUERY_CACHE_PATH} has shape {query_matrix.shape}, expected ({len(query_ids)}, {EMBEDDING_DIMENSION}); ignoring it.")
+        return None, None
+    return query_ids, query_matrix
+
+
+def save_query_embeddings(fingerprint: str, query_ids: list[str], query_vectors: list):
+    """Writes the per-dataset query cache. Failures are logged and otherwise ignored."""
+    try:
+        query_matrix = np.stack(query_vectors).astype(np.float32, copy=False)
+    except ValueError as e:
+        logging.warning(f"Not caching query embeddings, vectors have inconsistent dimensions: {e}")
+        return
+    try:
+        os.makedirs(os.path.dirname(QUERY_CACHE_PATH), exist_ok=True)
+        # The matrix, ids and fingerprint share one file that is swapped in with a single os.replace,
+        # so a reader sees either the old cache or the new one, never a mix of the two.
+        tmp_path = f"{QUERY_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:  # A file object stops np.savez from appending ".npz" to the name
+            np.savez(f, query_matrix=query_matrix, query_ids=np.array(query_ids, dtype=str),
+                     fingerprint=np.array(fingerprint))
+        os.replace(tmp_path, QUERY_CACHE_PATH)
+    except OSError as e:
+        logging.warning(f"Failed to write query embedding cache {QUERY_CACHE_PATH}: {e}")
+
+
 # --- 2. E5 Inference API Function for Queries ---
-# This function is identical to the one in the ingestion script, ensuring consistency.
-def get_embedding_for_text(text: str):
+# This function mirrors the one in the ingestion script, ensuring consistency.
+@async_disk_cached(E5_INFERENCE_API_URL_FOR_QUERY)
+async def get_embedding_for_text(http_client: httpx.AsyncClient, text: str):
     """
     Calls your E5 inference service to get a single embedding for a query.
     Extracts the vector based on E5_VECTOR_KEY_IN_RESPONSE.
@@ -45,134 +142,170 @@ def get_embedding_for_text(text: str):
     try:
         payload = {"text": text}
 
-        response = requests.post(E5_INFERENCE_API_URL_FOR_QUERY, json=payload, timeout=60)
+        response = await http_client.post(E5_INFERENCE_API_URL_FOR_QUERY, json=payload, headers=E5_ACCEPT_HEADERS, timeout=60)
         response.raise_for_status()
 
-        json_response = response.json()
+        return decode_embedding_response(response, text)
 
-        if E5_VECTOR_KEY_IN_RESPONSE:
-            vector = json_response.get(E5_VECTOR_KEY_IN_RESPONSE)
-            if vector is None:
-                logging.error(
-                    f"E5 API response missing key '{E5_VECTOR_KEY_IN_RESPONSE}' for query (first 100 chars): '{text[:100]}...': {json_response}")
-                return None
-        else:
-            vector = json_response
-
-        if not isinstance(vector, list) and not (hasattr(vector, 'dtype') and 'float' in str(vector.dtype)):
-            logging.error(
-                f"E5 API response vector for query is not a list of numbers. Type: {type(vector)}, Value: {str(vector)[:200]}...")
-            return None
-
-        return vector
-
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logging.error(f"E5 inference API request timed out for query (first 100 chars): '{text[:100]}...'")
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error calling E5 inference API for query (first 100 chars): '{text[:100]}...': {e}")
         return None
-    except json.JSONDecodeError:
-        logging.error(
-            f"E5 inference API returned non-JSON response for query (first 100 chars): '{text[:100]}...'. Response: {response.text}")
-        return None
     except Exception as e:
         logging.error(f"Unexpected error in get_embedding_for_text for query (first 100 chars): '{text[:100]}...': {e}")
         return None
 
 
-# --- 3. Connect to Weaviate ---
-logging.info("Connecting to Weaviate...")
-client = None
-try:
-    client = weaviate.connect_to_local(
+async def get_embeddings_for_texts(http_client: httpx.AsyncClient, texts: list[str],
+                                   max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT):
+    """
+    Embeds a list of texts and returns the vectors in input order (None for failed texts).
+    The E5 /vectors endpoint accepts a single text per request, so texts are sent as concurrent
+    single-text requests, at most `max_in_flight` at a time.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def embed(text):
+        async with semaphore:
+            return await get_embedding_for_text(http_client, text)
+
+    return await asyncio.gather(*(embed(text) for text in texts))
+
+
+async def main():
+    # --- 3. Connect to Weaviate ---
+    logging.info("Connecting to Weaviate...")
+    client = weaviate.use_async_with_local(
         host=WEAVIATE_HOST,
         port=WEAVIATE_PORT,
         grpc_port=WEAVIATE_GRPC_PORT,
     )
-    client.is_live()
-    logging.info("Successfully connected to Weaviate!")
-except Exception as e:
-    logging.critical(
-        f"Could not connect to Weaviate. Please ensure your Docker container is running and accessible: {e}")
-    exit(1)
+    try:
+        await client.connect()  # Fails fast if Weaviate is not reachable, no separate is_live() probe needed
+        logging.info("Successfully connected to Weaviate!")
+    except Exception as e:
+        logging.critical(
+            f"Could not connect to Weaviate. Please ensure your Docker container is running and accessible: {e}")
+        exit(1)
 
-# Get the collection
-try:
-    documents_collection = client.collections.get(COLLECTION_NAME)
-    logging.info(f"Successfully retrieved collection '{COLLECTION_NAME}'.")
-except Exception as e:
-    logging.critical(
-        f"Failed to get Weaviate collection '{COLLECTION_NAME}'. It might not be created or populated correctly. Error: {e}")
-    if client:
-        client.close()
-    exit(1)
+    try:
+        # Get the collection
+        try:
+            documents_collection = client.collections.get(COLLECTION_NAME)
+            logging.info(f"Successfully retrieved collection '{COLLECTION_NAME}'.")
+        except Exception as e:
+            logging.critical(
+                f"Failed to get Weaviate collection '{COLLECTION_NAME}'. It might not be created or populated correctly. Error: {e}")
+            exit(1)
+
+        # --- 4. Perform Searches in Weaviate for each query ---
+        logging.info(f"Performing searches in Weaviate collection '{COLLECTION_NAME}'...")
+        results = {}  # This will store results in the format expected by BEIR evaluator
 
-# --- 4. Perform Searches in Weaviate for each query ---
-logging.info(f"Performing searches in Weaviate collection '{COLLECTION_NAME}'...")
-results = {}  # This will store results in the format expected by BEIR evaluator
+        k_values = [1, 3, 5, 10, 100]  # Define k values for evaluation metrics
+        max_k = max(k_values)
 
-k_values = [1, 3, 5, 10, 100]  # Define k values for evaluation metrics
-max_k = max(k_values)
+        num_queries_processed = 0
+        num_queries_skipped = 0
 
-num_queries_processed = 0
-num_queries_skipped = 0
+        # Embed all queries up front so the search phase only waits on Weaviate.
+        # The query matrix is cached per dataset, so repeated evaluations skip the E5 service entirely.
+        all_query_ids = list(queries.keys())
+        query_texts = [QUERY_PREFIX + query_text for query_text in queries.values()]
+        fingerprint = query_cache_fingerprint(all_query_ids, query_texts)
+        query_ids, query_matrix = load_query_embeddings(fingerprint)
+        if query_ids is not None:
+            logging.info(f"Loaded {len(query_ids)} query embeddings from {QUERY_CACHE_PATH}.")
+            query_vectors = dict(zip(query_ids, query_matrix))
+        else:
+            logging.info("Embedding queries...")
+            limits = httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS * 2, max_keepalive_connections=MAX_CONCURRENT_REQUESTS)
+            async with httpx.AsyncClient(limits=limits, transport=httpx.AsyncHTTPTransport(retries=3)) as http_client:
+                embedded = await get_embeddings_for_texts(http_client, query_texts)
 
-for query_id, query_text in tqdm(queries.items(), desc="Searching Weaviate"):
-    # First, get the embedding for the query
-    query_vector = get_embedding_for_text("query: " + query_text)
+            query_vectors = {}
+            for query_id, query_vector in zip(all_query_ids, embedded):
+                if query_vector is None:
+                    logging.warning(f"Skipping query {query_id} due to embedding error.")
+                    num_queries_skipped += 1
+                else:
+                    query_vectors[query_id] = query_vector
 
-    if query_vector is None:
-        logging.warning(f"Skipping query {query_id} due to embedding error.")
-        num_queries_skipped += 1
-        continue  # Skip this query if embedding fails
+            # Only cache a complete matrix, so failed queries are retried on the next run
+            if num_queries_skipped == 0 and query_vectors:
+                save_query_embeddings(fingerprint, list(query_vectors), list(query_vectors.values()))
 
-    try:
-        # Perform a near_vector search using the pre-computed query embedding
-        response = documents_collection.query.near_vector(
-            near_vector=query_vector,  # Pass the vector directly for search
-            limit=max_k,  # Retrieve enough results to cover all k_values
-            return_properties=["original_doc_id"],  # Crucial for mapping back to qrels
-            return_metadata=weaviate.classes.query.MetadataQuery(score=True)  # Get scores for ranking
-        )
-
-        results[query_id] = {}
-        for obj in response.objects:
-            doc_id_from_weaviate = obj.properties.get("original_doc_id")
-            if doc_id_from_weaviate:
-                results[query_id][doc_id_from_weaviate] = obj.metadata.score
+        # The v4 client has no multi-query search RPC, so searches are issued as concurrent near_vector
+        # calls over the one gRPC channel. The semaphore caps in-flight searches without making a
+        # group of them wait for its slowest member.
+        near_vector = documents_collection.query.near_vector
+        semaphore = asyncio.Semaphore(SEARCH_MAX_IN_FLIGHT)
+
+        async def handle(query_id, query_vector):
+            """
+            Searches Weaviate with a pre-computed query vector.
+            Returns (query_id, response) or (query_id, None) on failure.
+            """
+            async with semaphore:
+                try:
+                    # Perform a near_vector search using the pre-computed query embedding
+                    response = await near_vector(
+                        near_vector=query_vector,  # Pass the vector directly for search
+                        limit=max_k,  # Retrieve enough results to cover all k_values
+                        return_properties=RETURN_PROPS,
+                        return_metadata=META
+                    )
+                    return query_id, response
+                except Exception as e:
+                    logging.error(f"Error during Weaviate search for query {query_id}: {e}")
+                    return query_id, None
+
+        responses = await tqdm_asyncio.gather(*(handle(q, v) for q, v in query_vectors.items()),
+                                              desc="Searching Weaviate")
+
+        for query_id, response in responses:
+            if response is None:
+                num_queries_skipped += 1
+                continue
+
+            # Pull ids and scores out as two aligned columns, then zip them into the per-query dict
+            objs = response.objects
+            doc_ids = [obj.properties.get("original_doc_id") for obj in objs]
+            scores = list(map(get_score, objs))
+            if all(doc_ids):
+                results[query_id] = dict(zip(doc_ids, scores))
             else:
-                logging.warning(
-                    f"original_doc_id property not found for object {obj.uuid} from query {query_id}. Skipping this document for evaluation.")
-        num_queries_processed += 1
+                results[query_id] = {doc_id: score for doc_id, score in zip(doc_ids, scores) if doc_id}
+                for obj, doc_id in zip(objs, doc_ids):
+                    if not doc_id:
+                        logging.warning(
+                            f"original_doc_id property not found for object {obj.uuid} from query {query_id}. Skipping this document for evaluation.")
+            num_queries_processed += 1
 
-    except Exception as e:
-        logging.error(f"Error during Weaviate search for query {query_id}: {e}")
-        num_queries_skipped += 1
+        logging.info(f"Search complete. Processed {num_queries_processed} queries, skipped {num_queries_skipped} queries.")
+        logging.info("Evaluating results...")
 
-logging.info(f"Search complete. Processed {num_queries_processed} queries, skipped {num_queries_skipped} queries.")
-logging.info("Evaluating results...")
+        # --- 5. Evaluate the results with the vectorized BEIR-equivalent metrics ---
+        if not results:
+            logging.critical("No search results to evaluate. Please check ingestion and search steps.")
+            exit(1)
 
-# --- 5. Evaluate the results using BEIR's `EvaluateRetrieval` class ---
-if not results:
-    logging.critical("No search results to evaluate. Please check ingestion and search steps.")
-    if client:
-        client.close()
-    exit(1)
+        try:
+            ndcg, _map, _recall, _precision = fast_evaluate(qrels, results, k_values)
 
-try:
-    retriever = EvaluateRetrieval(k_values=k_values)
-    ndcg, _map, _recall, _precision = retriever.evaluate(qrels, results, k_values)
+            logging.info("\n--- Evaluation Results ---")
+            logging.info(f"NDCG@{k_values}: {ndcg}")
+            logging.info(f"MAP@{k_values}: {_map}")
+            logging.info(f"Recall@{k_values}: {_recall}")
+            logging.info(f"Precision@{k_values}: {_precision}")
 
-    logging.info("\n--- Evaluation Results ---")
-    logging.info(f"NDCG@{k_values}: {ndcg}")
-    logging.info(f"MAP@{k_values}: {_map}")
-    logging.info(f"Recall@{k_values}: {_recall}")
-    logging.info(f"Precision@{k_values}: {_precision}")
+        except Exception as e:
+            logging.critical(f"Error during evaluation: {e}")
+    finally:
+        await client.close()
+        logging.info("Weaviate client closed.")
 
-except Exception as e:
-    logging.critical(f"Error during BEIR evaluation: {e}")
-finally:
-    if client:
-        client.close()
-        logging.info("Weaviate client closed.")
\ No newline at end of file
+
+asyncio.run(main())
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+
+def _check_score(query_id, doc_id, score) -> float:
+    """
+    Converts a retrieval score to float. Missing or non-finite scores would silently fall back to
+    doc-id order when ranking, so they raise instead.
+    """
+    try:
+        value = float(score)
+    except (TypeError, ValueError):
+        raise ValueError(f"Score for document {doc_id} of query {query_id} is not a number: {score!r}") from None
+    if not math.isfinite(value):
+        raise ValueError(f"Score for document {doc_id} of query {query_id} is not finite: {score!r}")
+    return value
+
+
+def fast_evaluate(qrels: dict, results: dict, k_values: list[int], ignore_identical_ids: bool = True):
+    """
+    Computes NDCG@k, MAP@k, Recall@k and P@k with the same definitions and output format as BEIR's
+    `EvaluateRetrieval.evaluate` (trec_eval semantics), but on dense (Q, K) numpy arrays instead of
+    per-query Python dicts. Only queries present in both `qrels` and `results` are scored.
+    """
+    max_k = max(k_values)
+    query_ids = [query_id for query_id in results if query_id in qrels]
+    num_queries = len(query_ids)
+
+    # rels[q, r] is the judged relevance of the document at rank r; ideal[q, r] is the r-th best judgement
+    rels = np.zeros((num_queries, max_k), dtype=np.float64)
+    ideal = np.zeros((num_queries, max_k), dtype=np.float64)
+    num_relevant = np.zeros(num_queries, dtype=np.float64)
+    for row, query_id in enumerate(query_ids):
+        query_qrels = qrels[query_id]
+        scored = [(doc_id, _check_score(query_id, doc_id, score)) for doc_id, score in results[query_id].items()
+                  if not (ignore_identical_ids and doc_id == query_id)]
+        # trec_eval ranks by score, breaking ties by doc id, both descending
+        ranked = sorted(scored, key=lambda item: (item[1], item[0]), reverse=True)[:max_k]
+        rels[row, :len(ranked)] = [query_qrels.get(doc_id, 0) for doc_id, _ in ranked]
+        judged = sorted(query_qrels.values(), reverse=True)[:max_k]
+        ideal[row, :len(judged)] = judged
+        num_relevant[row] = sum(1 for rel in query_qrels.values() if rel >= 1)
+
+    ranks = np.arange(1, max_k + 1)
+    discounts = 1.0 / np.log2(ranks + 1)
+    dcg = np.cumsum(np.clip(rels, 0, None) * discounts, axis=1)
+    idcg = np.cumsum(np.clip(ideal, 0, None) * discounts, axis=1)
+    hits = (rels >= 1).astype(np.float64)
+    num_hits = np.cumsum(hits, axis=1)
+    average_precision = np.cumsum(hits * num_hits / ranks, axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndcg_matrix = np.where(idcg > 0, dcg / idcg, 0.0)
+        denominator = num_relevant[:, None]
+        map_matrix = np.where(denominator > 0, average_precision / denominator, 0.0)
+        recall_matrix = np.where(denominator > 0, num_hits / denominator, 0.0)
+    precision_matrix = num_hits / ranks
+
+    ndcg, _map, recall, precision = {}, {}, {}, {}
+    for k in k_values:
+        column = k - 1
+        ndcg[f"NDCG@{k}"] = round(float(ndcg_matrix[:, column].mean()), 5) if num_queries else 0.0
+        _map[f"MAP@{k}"] = round(float(map_matrix[:, column].mean()), 5) if num_queries else 0.0
+        recall[f"Recall@{k}"] = round(float(recall_matrix[:, column].mean()), 5) if num_queries else 0.0
+        precision[f"P@{k}"] = round(float(precision_matrix[:, column].mean()), 5) if num_queries else 0.0
+    return ndcg, _map, recall, precision
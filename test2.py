@@ -1,11 +1,18 @@
 import weaviate
 import os
-from beir.datasets.data_loader import GenericDataLoader
 from beir.util import download_and_unzip
-from weaviate.classes.config import Property, DataType
+from weaviate.classes.config import Configure, Property, DataType
+from weaviate.classes.init import AdditionalConfig, Timeout
 from tqdm.autonotebook import tqdm
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
+import itertools
+import hashlib
+from e5_client import E5_ACCEPT_HEADERS, decode_embedding_response, json_loads
+from embedding_cache import disk_cached
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging  # Import logging module for better error reporting
 
 # --- Configure Logging ---
@@ -19,13 +26,12 @@ WEAVIATE_PORT = 8080
 WEAVIATE_GRPC_PORT = 50051
 COLLECTION_NAME = "document_v4"
 E5_INFERENCE_API_URL = "http://localhost:8081/vectors"  # Endpoint from your screenshot
-# IMPORTANT: Adjust this key based on the actual JSON response from your /vectors endpoint.
-# Common keys are 'vector', 'embedding', 'embeddings', 'data', etc.
-# If `curl -X POST -H "Content-Type: application/json" -d '{"text": "test"}' http://localhost:8081/vectors`
-# returns {"embedding": [0.1, 0.2, ...]}, then set this to 'embedding'.
-# If it returns {"vector": [0.1, 0.2, ...]}, then set this to 'vector'.
-# If it returns [0.1, 0.2, ...], then set this to None (meaning response.json() is directly the list).
-E5_VECTOR_KEY_IN_RESPONSE = 'vector'  # <<< YOU MIGHT NEED TO CHANGE THIS BASED ON ACTUAL API RESPONSE
+PASSAGE_PREFIX = "passage: "  # E5 expects documents to be prefixed with "passage: "
+MAX_WORKERS = 32  # Concurrent embedding requests; match the E5 server's parallelism
+INSERT_BATCH_SIZE = 200  # Objects per gRPC BatchObjects request
+INSERT_CONCURRENT_REQUESTS = 4  # Parallel BatchObjects requests; raise until Weaviate's gRPC CPU saturates
+INGEST_WINDOW_SIZE = 1024  # Documents read and embedded together; bounds peak memory
+CORPUS_PATH = os.path.join(DATA_PATH, DATASET_NAME, "corpus.jsonl")
 
 # --- 1. Download SciFact dataset ---
 logging.info(f"Downloading and unzipping {DATASET_NAME} dataset...")
@@ -37,17 +43,39 @@ except Exception as e:
     logging.error(f"Failed to download or unzip dataset: {e}")
     exit(1)
 
-# --- 2. Load dataset ---
-logging.info(f"Loading {DATASET_NAME} dataset...")
+# --- 2. Stream dataset ---
+# The corpus is read lazily from corpus.jsonl instead of loading it into a dict up front,
+# so ingestion starts immediately and memory stays bounded by INGEST_WINDOW_SIZE.
+def iter_corpus(path: str):
+    """Yields (doc_id, doc_data) pairs from a BEIR corpus.jsonl file, one line at a time."""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                record = json_loads(line)
+                yield record["_id"], record
+
+
 try:
-    corpus, queries, qrels = GenericDataLoader(os.path.join(DATA_PATH, DATASET_NAME)).load(split="test")
-    logging.info(f"Dataset loaded. Corpus size: {len(corpus)}")
+    with open(CORPUS_PATH, "rb") as f:
+        corpus_size = sum(1 for line in f if line.strip())
+    logging.info(f"Dataset found. Corpus size: {corpus_size}")
 except Exception as e:
-    logging.error(f"Failed to load dataset: {e}")
+    logging.error(f"Failed to read dataset corpus {CORPUS_PATH}: {e}")
     exit(1)
 
 
 # --- 3. E5 Inference API Function ---
+# Shared session so every embedding call reuses a pooled keep-alive connection
+# instead of opening a new TCP connection per request.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,  # Must cover MAX_WORKERS, otherwise threads block waiting for a connection
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504], allowed_methods=None),
+))
+
+
+@disk_cached(E5_INFERENCE_API_URL)
 def get_embedding_for_text(text: str):
     """
     Calls your E5 inference service to get a single embedding.
@@ -59,28 +87,10 @@ def get_embedding_for_text(text: str):
         # Add config if you need specific pooling/task_type, e.g.,
         # payload["config"] = {"pooling_strategy": "mean", "task_type": "retrieval"}
 
-        response = requests.post(E5_INFERENCE_API_URL, json=payload, timeout=60)  # Increased timeout
+        response = SESSION.post(E5_INFERENCE_API_URL, json=payload, headers=E5_ACCEPT_HEADERS, timeout=60)  # Increased timeout
         response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
 
-        json_response = response.json()
-
-        if E5_VECTOR_KEY_IN_RESPONSE:
-            # Extract vector from specific key
-            vector = json_response.get(E5_VECTOR_KEY_IN_RESPONSE)
-            if vector is None:
-                logging.error(f"E5 API response missing key '{E5_VECTOR_KEY_IN_RESPONSE}': {json_response}")
-                return None
-        else:
-            # Assume response.json() is directly the vector list
-            vector = json_response
-
-        if not isinstance(vector, list) and not (hasattr(vector, 'dtype') and 'float' in str(
-                vector.dtype)):  # Check if it's a list or numpy array of floats
-            logging.error(
-                f"E5 API response vector is not a list of numbers. Type: {type(vector)}, Value: {str(vector)[:200]}...")
-            return None
-
-        return vector
+        return decode_embedding_response(response, text)
 
     except requests.exceptions.Timeout:
         logging.error(f"E5 inference API request timed out for text (first 100 chars): '{text[:100]}...'")
@@ -88,15 +98,19 @@ def get_embedding_for_text(text: str):
     except requests.exceptions.RequestException as e:
         logging.error(f"Error calling E5 inference API for text (first 100 chars): '{text[:100]}...': {e}")
         return None
-    except json.JSONDecodeError:
-        logging.error(
-            f"E5 inference API returned non-JSON response for text (first 100 chars): '{text[:100]}...'. Response: {response.text}")
-        return None
     except Exception as e:
         logging.error(f"Unexpected error in get_embedding_for_text for text (first 100 chars): '{text[:100]}...': {e}")
         return None
 
 
+def dedup_key(text: str) -> bytes:
+    """
+    Key under which texts share one embedding. Only exact repeats are merged: whether case or
+    spacing changes the vector depends on the model's tokenizer, which this script cannot see.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
 # --- 4. Connect to Weaviate ---
 logging.info("Connecting to Weaviate...")
 client = None
@@ -105,8 +119,8 @@ try:
         host=WEAVIATE_HOST,
         port=WEAVIATE_PORT,
         grpc_port=WEAVIATE_GRPC_PORT,
-    )
-    client.is_live()
+        additional_config=AdditionalConfig(timeout=Timeout(insert=120)),  # Headroom for large concurrent batches
+    )  # connect_to_local fails fast if Weaviate is not reachable, no separate is_live() probe needed
     logging.info("Successfully connected to Weaviate!")
 except Exception as e:
     logging.critical(
@@ -131,6 +145,14 @@ try:
             Property(name="original_doc_id", data_type=DataType.TEXT)  # Crucial for BEIR evaluation
         ],
         # No vectorizer_config here, as we are providing vectors directly
+        # Binary quantization keeps a 1-bit copy of each vector in memory for HNSW traversal and
+        # rescores the top candidates with the full float32 vectors to preserve recall.
+        # For higher compression use Configure.VectorIndex.Quantizer.pq(segments=128, training_limit=100000).
+        vector_index_config=Configure.VectorIndex.hnsw(
+            quantizer=Configure.VectorIndex.Quantizer.bq(rescore_limit=200, cache=True),
+            ef_construction=128,
+            max_connections=32,
+        ),
     )
     logging.info(f"Collection '{COLLECTION_NAME}' created successfully!")
 except Exception as e:
@@ -145,33 +167,57 @@ logging.info("Starting batch ingestion with external embedding generation...")
 
 num_inserted = 0
 num_skipped = 0
-
-with documents_collection.batch.dynamic() as batch:
-    for doc_id, doc_data in tqdm(corpus.items(), desc="Ingesting documents"):
-        text_to_embed = "passage: " + doc_data.get("text", "")
-
-        # Get embedding for the current text
-        current_vector = get_embedding_for_text(text_to_embed)
-
-        if current_vector is not None:
-            try:
-                batch.add_object(
-                    properties={
-                        "original_doc_id": doc_id,
-                        "title": doc_data.get("title", ""),
-                        "text": doc_data.get("text", "")
-                    },
-                    vector=current_vector  # Provide the vector directly
-                )
-                num_inserted += 1
-            except Exception as e:
-                logging.error(f"Failed to add object {doc_id} to Weaviate batch: {e}")
-                num_skipped += 1
-        else:
-            num_skipped += 1
-            # Error message already logged by get_embedding_for_text
+num_deduplicated = 0
+
+# Embedding requests run on a thread pool; each vector is handed to the Weaviate batch
+# as soon as it arrives, so inserts are pipelined with the remaining embedding work.
+corpus_iter = iter_corpus(CORPUS_PATH)
+with (
+    documents_collection.batch.fixed_size(batch_size=INSERT_BATCH_SIZE,
+                                          concurrent_requests=INSERT_CONCURRENT_REQUESTS) as batch,
+    ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor,
+    tqdm(total=corpus_size, desc="Ingesting documents") as pbar,
+):
+    while window := list(itertools.islice(corpus_iter, INGEST_WINDOW_SIZE)):
+        texts = [PASSAGE_PREFIX + doc_data.get("text", "") for _, doc_data in window]
+        # Duplicate texts within the window share one embedding request; exact repeats across
+        # windows are already served by the on-disk embedding cache.
+        key_to_future = {}
+        future_to_items = {}
+        for text, item in zip(texts, window):
+            key = dedup_key(text)
+            future = key_to_future.get(key)
+            if future is None:
+                future = key_to_future[key] = executor.submit(get_embedding_for_text, text)
+                future_to_items[future] = []
+            else:
+                num_deduplicated += 1
+            future_to_items[future].append(item)
+
+        for future in as_completed(future_to_items):
+            current_vector = future.result()  # get_embedding_for_text logs and returns None instead of raising
+            for doc_id, doc_data in future_to_items[future]:
+                pbar.update(1)
+                if current_vector is not None:
+                    try:
+                        batch.add_object(
+                            properties={
+                                "original_doc_id": doc_id,
+                                "title": doc_data.get("title", ""),
+                                "text": doc_data.get("text", "")
+                            },
+                            vector=current_vector  # Provide the vector directly
+                        )
+                        num_inserted += 1
+                    except Exception as e:
+                        logging.error(f"Failed to add object {doc_id} to Weaviate batch: {e}")
+                        num_skipped += 1
+                else:
+                    num_skipped += 1
+                    # Error message already logged by get_embedding_for_text
 
 logging.info(f"Finished ingestion. Inserted {num_inserted} documents. Skipped {num_skipped} documents due to errors.")
+logging.info(f"Reused embeddings for {num_deduplicated} duplicate documents.")
 if client:
     client.close()
     logging.info("Ingestion client closed.")
\ No newline at end of file
@@ -0,0 +1,40 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from e5_client import E5_VECTOR_KEY_IN_RESPONSE, EMBEDDING_DIMENSION, decode_embedding_response
+
+
+def make_response(content: bytes, content_type: str):
+    """Minimal stand-in exposing the attributes both requests and httpx responses share."""
+    return SimpleNamespace(headers={"content-type": content_type}, content=content, text=content.decode("latin-1"))
+
+
+def json_response(vector):
+    body = {E5_VECTOR_KEY_IN_RESPONSE: vector} if E5_VECTOR_KEY_IN_RESPONSE else vector
+    return make_response(json.dumps(body).encode(), "application/json")
+
+
+def test_decodes_binary_and_json_vectors():
+    expected = np.arange(EMBEDDING_DIMENSION, dtype=np.float32)
+    binary = decode_embedding_response(make_response(expected.astype("<f4").tobytes(), "application/octet-stream"), "t")
+    parsed = decode_embedding_response(json_response(expected.tolist()), "t")
+    for vector in (binary, parsed):
+        assert vector.dtype == np.float32
+        np.testing.assert_array_equal(vector, expected)
+
+
+@pytest.mark.parametrize("num_bytes", [0, 3, 4 * (EMBEDDING_DIMENSION - 1), 4 * EMBEDDING_DIMENSION + 2])
+def test_rejects_binary_bodies_of_the_wrong_size(num_bytes):
+    assert decode_embedding_response(make_response(b"\0" * num_bytes, "application/octet-stream"), "t") is None
+
+
+@pytest.mark.parametrize("vector", [[], [0.0] * (EMBEDDING_DIMENSION + 1), [[0.0] * EMBEDDING_DIMENSION], "oops"])
+def test_rejects_json_vectors_of_the_wrong_shape(vector):
+    assert decode_embedding_response(json_response(vector), "t") is None
+
+
+def test_rejects_non_json_bodies():
+    assert decode_embedding_response(make_response(b"<html>", "text/html"), "t") is None
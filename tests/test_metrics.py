@@ -0,0 +1,77 @@
+import math
+import random
+
+import pytest
+
+from metrics import fast_evaluate
+
+K_VALUES = [1, 3, 5, 10, 20]
+
+
+def reference_evaluate(qrels, results, k_values):
+    """Straightforward per-query trec_eval definitions, as computed by pytrec_eval inside BEIR."""
+    totals = {k: [0.0, 0.0, 0.0, 0.0] for k in k_values}
+    num_queries = 0
+    for query_id, scores in results.items():
+        if query_id not in qrels:
+            continue
+        num_queries += 1
+        query_qrels = qrels[query_id]
+        ranked = sorted(((doc_id, score) for doc_id, score in scores.items() if doc_id != query_id),
+                        key=lambda item: (item[1], item[0]), reverse=True)
+        num_relevant = sum(1 for rel in query_qrels.values() if rel >= 1)
+        ideal = sorted(query_qrels.values(), reverse=True)
+        for k in k_values:
+            top = ranked[:k]
+            dcg = sum(max(query_qrels.get(doc_id, 0), 0) / math.log2(rank + 2) for rank, (doc_id, _) in enumerate(top))
+            idcg = sum(max(rel, 0) / math.log2(rank + 2) for rank, rel in enumerate(ideal[:k]))
+            hits = 0
+            average_precision = 0.0
+            for rank, (doc_id, _) in enumerate(top):
+                if query_qrels.get(doc_id, 0) >= 1:
+                    hits += 1
+                    average_precision += hits / (rank + 1)
+            totals[k][0] += dcg / idcg if idcg else 0.0
+            totals[k][1] += average_precision / num_relevant if num_relevant else 0.0
+            totals[k][2] += hits / num_relevant if num_relevant else 0.0
+            totals[k][3] += hits / k
+    return tuple(
+        {f"{name}@{k}": round(totals[k][i] / num_queries, 5) for k in k_values}
+        for i, name in enumerate(["NDCG", "MAP", "Recall", "P"])
+    )
+
+
+def random_run(rng):
+    docs = [f"d{i}" for i in range(60)]
+    qrels, results = {}, {}
+    for q in range(20):
+        query_id = f"q{q}"
+        qrels[query_id] = {doc_id: rng.choice([0, 1, 2]) for doc_id in rng.sample(docs, rng.randint(1, 6))}
+        # Coarse scores so ties (broken by doc id) are common
+        results[query_id] = {doc_id: round(rng.random(), 1) for doc_id in rng.sample(docs, rng.randint(0, 40))}
+    results["q0"]["q0"] = 10.0  # Identical query/doc ids are ignored
+    results["not_judged"] = {"d1": 1.0}  # Queries without qrels are not scored
+    return qrels, results
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_fast_evaluate_matches_reference(seed):
+    qrels, results = random_run(random.Random(seed))
+
+    expected = reference_evaluate(qrels, results, K_VALUES)
+    actual = fast_evaluate(qrels, results, K_VALUES)
+
+    for expected_metric, actual_metric in zip(expected, actual):
+        assert actual_metric.keys() == expected_metric.keys()
+        for name, value in expected_metric.items():
+            # Both sides round to 5 places, so float noise can flip the last digit
+            assert actual_metric[name] == pytest.approx(value, abs=1e-5 + 1e-9), name
+
+
+@pytest.mark.parametrize("bad_score", [None, float("nan"), float("inf"), "high"])
+def test_fast_evaluate_rejects_missing_or_non_finite_scores(bad_score):
+    qrels = {"q1": {"d1": 1}}
+    results = {"q1": {"d1": 0.5, "d2": bad_score}}
+
+    with pytest.raises(ValueError):
+        fast_evaluate(qrels, results, [1])